@@ -10,16 +10,23 @@ Functions and their Description
 -------------------------------
 bw_transform
     This function takes a string and returns its Burrow-Wheeler Transform.
+suffix_array
+    Takes a string with a string ending character at the end.
+    Returns the starting indices of its rotations in lexicographical order,
+    without materializing the rotations.
 make_rotations
     Takes a string with with a string ending character at the end.
     Returns a tuple of rotations of the text.
+    (naive method, used only when bw_transform is called with naive=True)
 sort_rotations
     This function takes a tuple of rotations of some text, and
     returns a sorted rotations as a tuple.
+    (naive method, used only when bw_transform is called with naive=True)
 sorted_rotations_to_bwt
     This function takes a tuple of rotations sorted in a lexicographical
     order and returns a string made of the last characters of the sorted
     rotations as the burrows-wheeler transform.
+    (naive method, used only when bw_transform is called with naive=True)
 
 ----------------------------------------
 Functions for main and their description
@@ -31,6 +38,14 @@ process_file
 encode_file_as_word_list
     Takes a file path (str) and creates a tuple of encodings, corresponding
     to the words in the file at the path.
+encode_line
+    Takes a line number and a line of text, and returns its encoding and
+    the message to print for the line, if any.
+encode_lines
+    Runs encode_line over a slice of lines, the unit of work of a worker.
+slice_lines
+    Splits a list of lines into slices with about the same number of
+    characters.
 validate_text
     Validates text with the following test:
     Checks to see if the text has any characters that are not in ALPHABET.
@@ -73,9 +88,21 @@ About Burrows-Wheeler Transform
         4. Gather the character at the end of all the sorted rotations and
         return this as the BWT:
         'k$avrraad'
+
+    * Steps 2 and 3 need O(n^2) memory if the rotations are written out.
+    bw_transform instead sorts the starting indices of the rotations (the
+    suffix array of 'aardvark$'), and reads the character preceding each
+    index, since the last character of the rotation starting at i is
+    text[i - 1]:
+        suffix array    (8, 0, 1, 5, 3, 7, 2, 6, 4)
+        BWT             'k$avrraad'
 '''
 
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from operator import itemgetter
 import os
+from string import ascii_lowercase, ascii_uppercase, digits
 from common import (
     all_chars_in_alphabet,
     authenticate,
@@ -84,20 +111,20 @@ from common import (
     get_string,
     validate_file
     )
+try:    # optional, libdivsufsort builds suffix arrays in C
+    from pydivsufsort import divsufsort
+except ImportError:
+    divsufsort = None
 
 # GLOBAL VARIABLES
-ALPHABET = set()
-# add whitespace
-ALPHABET.add(chr(32))
-# add numbers 0 - 9
-for val in range(48, 48+10):
-    ALPHABET.add(chr(val))
-# add A-Z
-for val in range(65, 65+26):
-    ALPHABET.add(chr(val))
-# add a-z
-for val in range(97, 97+26):
-    ALPHABET.add(chr(val))
+# whitespace, numbers 0 - 9, A-Z and a-z
+ALPHABET = frozenset(' ' + digits + ascii_uppercase + ascii_lowercase)
+# bytes of ALPHABET, deleted from text to find characters not in ALPHABET
+_ALPHABET_BYTES = ''.join(sorted(ALPHABET)).encode('ascii')
+# files with fewer characters are encoded in this process, encoding takes at
+# least about half a microsecond per character (more for long lines), starting
+# a pool of workers can take tens of milliseconds
+_POOL_MIN_CHARS = 1 << 18
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~ #
 # Functions for bw_transform #
@@ -139,10 +166,9 @@ def sorted_rotations_to_bwt(sorted_rotations: tuple) -> str:
 's$3 aardvark', 'varks$3 aard'))
     '3s$ avrraakd'
     '''
-    bwt = ''    # initiate bwt
-    # add last characater of each rotation in sorted_rotations to bwt
-    for rotation in sorted_rotations:
-        bwt += rotation[-1]
+    # join the last characater of each rotation in sorted_rotations once,
+    # rather than growing bwt one character at a time
+    bwt = ''.join([rotation[-1] for rotation in sorted_rotations])
     return bwt
 
 
@@ -221,23 +247,124 @@ def make_rotations(text: str) -> tuple:
     '''
     n = len(text)
     text2 = text + text
-    rotations = []
-    for i in range(n):  # find rotations and fill the list
-        rotations.append(text2[i:i+n])
+    # find rotations, the comprehension fills the list without appends
+    rotations = [text2[i:i+n] for i in range(n)]
     return tuple(rotations)
 
 
-def bw_transform(text: str, end_char: str = '$') -> str:
+def suffix_array(text: str) -> tuple:
+    '''
+    Takes a string with a string ending character at the end.
+    Returns the starting indices of the rotations of the text, sorted in
+    a lexicographical order. As the string ending character occurs only
+    once, this is the suffix array of the text.
+
+    The rotations are never made. Indices are first sorted into buckets by
+    their first 8 characters. Each bucket of rotations tied on their first
+    k characters is then sorted by the rank of the rotation starting at
+    i + k, which ranks them by their first 2k characters. Doubling k until
+    no bucket holds more than one rotation needs O(n) memory and compares
+    integers rather than strings of length n. Text of 256 characters or
+    fewer is sorted by its rotations, which is faster at that size. Text
+    longer than 1024 characters is given to libdivsufsort, if pydivsufsort
+    is installed.
+
+    Params:
+        text str, a string with a '$' at the end
+
+    Returns:
+        tuple(int)  starting indices of the stable-sorted rotations of text.
+
+    Examples:
+    >>> suffix_array('')
+    ()
+    >>> suffix_array('$')
+    (0,)
+    >>> suffix_array('a$')
+    (1, 0)
+    >>> suffix_array('mississippi$')
+    (11, 10, 7, 4, 1, 0, 9, 8, 6, 3, 5, 2)
+    >>> suffix_array('aardvark$')
+    (8, 0, 1, 5, 3, 7, 2, 6, 4)
+    >>> suffix_array('3 aardvarks$')
+    (1, 11, 0, 2, 3, 7, 5, 9, 4, 8, 10, 6)
+    >>> text = 'mississippi' * 30 + '$'
+    >>> suffix_array(text) == tuple(sorted(range(331), key=lambda i: text[i:]))
+    True
+    '''
+    n = len(text)
+    if n <= 256:
+        # short text, as in a file of words, sorting the rotations as strings
+        # in one C-level sort is faster than ranking, and needs 64 kB at most
+        text2 = text + text
+        return tuple(sorted(range(n), key=lambda i: text2[i:i + n]))
+    if divsufsort is not None and n > 1024 and text.isascii() and \
+            text.count(text[-1]) == 1:
+        # with a unique last character, sorting suffixes sorts rotations
+        return tuple(divsufsort(text.encode('ascii')).tolist())
+
+    def split(start, end, key, rank):
+        # sa[start:end] is sorted by key, rank each rotation by the position
+        # of the first rotation with the same key, return the buckets of
+        # rotations that are still tied
+        buckets = []
+        first = start
+        prev = key(sa[start])
+        for j in range(start, end):
+            i = sa[j]
+            curr = key(i)
+            if curr != prev:
+                if j - first > 1:
+                    buckets.append((first, j))
+                first = j
+                prev = curr
+            rank[i] = first
+        if end - first > 1:
+            buckets.append((first, end))
+        return buckets
+
+    # rank the rotations by their first k characters at once, a short
+    # string compared in C, rather than by one character at a time
+    k = 8
+    text2 = text + text[:k]
+    prefixes = [text2[i:i + k] for i in range(n)]
+    sa = sorted(range(n), key=prefixes.__getitem__)
+    rank = [0] * n
+    buckets = split(0, n, prefixes.__getitem__, rank)
+    # only the buckets of tied rotations are sorted again, by the rank of
+    # their next k characters, a rotation alone in its bucket is in place
+    while buckets and k < n:
+        new_rank = rank[:]
+        new_buckets = []
+        for start, end in buckets:
+            def key(i):
+                return rank[(i + k) % n]
+            # python's in-built sort is a stable sort
+            sa[start:end] = sorted(sa[start:end], key=key)
+            new_buckets += split(start, end, key, new_rank)
+        rank = new_rank
+        buckets = new_buckets
+        k *= 2
+    return tuple(sa)
+
+
+def bw_transform(text: str, end_char: str = '$', naive: bool = False) -> str:
     '''
     This function takes a string and returns its Burrow-Wheeler Transform.
 
     Params:
     str     text, assume for the first run that the text is only alphanumeric.
     end_char EOF character, default value is '$'.
+    naive   bool, if True the rotations are made and sorted as strings,
+            O(n^2) memory. Kept to check the suffix array method against.
 
     Returns:
     str     the burrows wheeler transform of text provided
 
+    Calls:
+    suffix_array
+    make_rotations, sort_rotations, sorted_rotations_to_bwt (if naive)
+
     Examples:
     >>> bw_transform('')
     '$'
@@ -249,13 +376,23 @@ def bw_transform(text: str, end_char: str = '$') -> str:
     'k$avrraad'
     >>> bw_transform('3 aardvarks')
     '3s$ avrraakd'
+    >>> bw_transform('3 aardvarks', naive=True)
+    '3s$ avrraakd'
     '''
     text = text + end_char   # add end_char to the end of the string
-    rotations = make_rotations(text)    # initiate and fill list of rotations
-    # sort rotations in lexicographical order
-    sorted_rotations = sort_rotations(rotations)
-    # create and return bwt from the sorted_rotations
-    bwt = sorted_rotations_to_bwt(sorted_rotations)
+    if naive:
+        rotations = make_rotations(text)    # initiate and fill rotations
+        # sort rotations in lexicographical order
+        sorted_rotations = sort_rotations(rotations)
+        # create and return bwt from the sorted_rotations
+        bwt = sorted_rotations_to_bwt(sorted_rotations)
+        return bwt
+    # sort the starting indices of the rotations
+    sa = suffix_array(text)
+    # the last character of the rotation starting at i is text[i - 1], that
+    # is shifted[i] with text shifted right by one, gathered in one C call
+    shifted = text[-1] + text[:-1]
+    bwt = ''.join(itemgetter(*sa)(shifted))
     return bwt
 
 # ~~~~ #
@@ -269,7 +406,8 @@ def print_help() -> None:
     '''
     print('')
     print('')
-    print("Usage: python3 bw_transform [-h|--help] [-f filename | -s string]")
+    print("Usage: python3 bw_transform [-h|--help] \
+[-f filename [--verify] | -s string]")
     print("")
     print("Options:")
     print("-h | --help")
@@ -283,6 +421,9 @@ def print_help() -> None:
     print("      but with an extension of .bwt.")
     print("    * Encoded text will have $ as EOF character.")
     print("    * If the encoding works function returns True, else None.")
+    print("--verify")
+    print("    * Only with -f. Checks each encoded line by decoding it back")
+    print("      to the text. Off by default as it doubles the work.")
     print("-s 'text'")
     print("    * Function looks for -f first then -s.")
     print("      If -f is found -s is ignored.")
@@ -322,16 +463,13 @@ def validate_text(text: str, line_no: int = None) -> str:
     'String has characters other than spaces and alphanumeric.'
     >>> validate_text('a$bab$s', 10)
     'Line no. 10 has characters other than spaces and alphanumeric.'
+    >>> validate_text('café')
+    'String has characters other than spaces and alphanumeric.'
     '''
-    # counting characters not in ALPHABET
-    count_non = 0
-    n = len(text)
-    for i in range(n):
-        if text[i] in ALPHABET:
-            continue
-        # else
-        count_non += 1
-    if count_non > 0:
+    # delete all the bytes of ALPHABET from text in one pass (bytes.translate
+    # runs in C), anything left is a character that is not in ALPHABET
+    if not text.isascii() or \
+            text.encode('ascii').translate(None, _ALPHABET_BYTES):
         if line_no:     # being used in a file
             return f'Line no. {line_no} has characters other than spaces \
 and alphanumeric.'
@@ -342,37 +480,135 @@ alphanumeric.'
     return text
 
 
+def encode_line(line_no: int,
+                raw_text: str,
+                end_char: str = '$',
+                verify: bool = False,
+                validated: bool = False) -> tuple:
+    '''
+    Takes a line number (int), a line of text (str), a user provided EOF
+    `end_char` and booleans `verify` and `validated`. Validates (unless
+    already `validated`) and encodes the stripped line, and if `verify`
+    authenticates the encoding.
+    Returns a tuple of the bwt ('' if the line is not processed) and the
+    message to print for the line (None if there is nothing to print).
+    Kept at module level so that it can be sent to worker processes.
+
+    >>> encode_line(1, '  banana\\n')
+    ('annb$aa', None)
+    >>> encode_line(2, 'a$b\\n')
+    ('', 'Line no. 2 has characters other than spaces and alphanumeric.')
+    >>> encode_line(3, 'banana', validated=True)
+    ('annb$aa', None)
+    '''
+    raw_text = raw_text.strip()
+    try:       # try and except for each line
+        text = raw_text if validated else validate_text(raw_text, line_no)
+        if text != raw_text:   # error
+            return '', text
+        bwt = bw_transform(text, end_char=end_char)
+        if not verify or authenticate(bwt, text, end_char=end_char):
+            return bwt, None
+        return '', f"Error while processing line no. {line_no}:\
+ unable to encode to BWT."
+    except Exception as e:
+        return '', f"Error while processing line no. {line_no}: {e}"
+
+
+def encode_lines(first_line_no: int,
+                 lines: list,
+                 end_char: str = '$',
+                 verify: bool = False,
+                 validated: bool = False) -> list:
+    '''
+    Takes the line number of the first line (int), a list of lines of text
+    and the arguments of encode_line. Returns a list of the encode_line
+    results, in order. A worker process is sent a slice of lines to loop
+    over, rather than one line at a time.
+    The line numbers in the messages count from `first_line_no`, so a slice
+    keeps the numbering of the file.
+
+    >>> results = encode_lines(5, ['banana', 'a$b'])
+    >>> results[0]
+    ('annb$aa', None)
+    >>> results[1]
+    ('', 'Line no. 6 has characters other than spaces and alphanumeric.')
+    '''
+    return [encode_line(line_no, raw_text, end_char, verify, validated)
+            for line_no, raw_text in enumerate(lines, first_line_no)]
+
+
+def slice_lines(lines: list, parts: int) -> tuple:
+    '''
+    Takes a list of lines of text and the number of slices wanted (int).
+    Returns a tuple of the indices of the first lines of the slices and a
+    tuple of the slices, at most `parts` consecutive slices with about the
+    same number of characters, since the work of a line grows with its
+    length.
+
+    >>> slice_lines(['a' * 10, 'b', 'c', 'd' * 10], 2)
+    ((0, 2), (['aaaaaaaaaa', 'b'], ['c', 'dddddddddd']))
+    >>> slice_lines(['abc', 'de'], 4)
+    ((0, 1), (['abc'], ['de']))
+    '''
+    total = sum(map(len, lines))
+    starts, slices = [], []
+    start = done = 0
+    for i, line in enumerate(lines):
+        done += len(line)
+        if done * parts >= total * (len(slices) + 1):
+            starts.append(start)
+            slices.append(lines[start:i + 1])
+            start = i + 1
+    if start < len(lines):
+        starts.append(start)
+        slices.append(lines[start:])
+    return tuple(starts), tuple(slices)
+
+
 def encode_file_as_word_list(input_file: str,
-                             end_char: str = '$') -> tuple | str:
+                             end_char: str = '$',
+                             verify: bool = False) -> tuple | str:
     '''
     Takes a file path (str) and creates a tuple of encodings, corresponding
     to the words in the file at the path.
+    If `verify`, each encoding is authenticated by decoding it again, which
+    doubles the work per line.
+    The lines are independent, so a large file, on a machine with more than
+    one CPU, is encoded in parallel by a pool of worker processes, each
+    given slices of lines with about the same number of characters. The
+    results are collected in order.
     '''
     # try and except for some unexpected error in reading the file
     try:
-        output_list = []
         with open(input_file, 'r') as f_in:
-            counter = 0
-            for raw_text in f_in:
-                raw_text = raw_text.strip()
-                try:       # try and except for each line
-                    text = validate_text(raw_text, counter)
-                    if text == raw_text:
-                        temp_bwt = bw_transform(text, end_char=end_char)
-                        if authenticate(temp_bwt, text, end_char=end_char):
-                            bwt = temp_bwt
-                        else:
-                            print(f"Error while processing line no. {counter}:\
- unable to encode to BWT.")
-                            bwt = ''
-                    else:  # error
-                        print(text)
-                        bwt = ''
-                except Exception as e:
-                    print(f"Error while processing line no. {counter}: {e}")
-                    bwt = ''
-                output_list.append(bwt)
-                counter += 1
+            data = f_in.read()     # the file is expected to be 1 MB or less
+        lines = data.split('\n')
+        if lines[-1] == '':     # the file ends with a newline
+            lines.pop()
+        # validate the whole file in one pass, if it only has characters in
+        # ALPHABET and newlines, the lines need not be validated one by one
+        validated = data.isascii() and \
+            not data.encode('ascii').translate(None, _ALPHABET_BYTES + b'\n')
+        workers = os.cpu_count() or 1
+        if workers == 1 or len(lines) < 2 or len(data) < _POOL_MIN_CHARS:
+            results = encode_lines(0, lines, end_char, verify, validated)
+        else:
+            # a few slices per worker, so that the work stays balanced
+            starts, slices = slice_lines(lines, workers * 4)
+            with ProcessPoolExecutor(workers) as executor:
+                batches = executor.map(encode_lines,
+                                       starts,
+                                       slices,
+                                       repeat(end_char),
+                                       repeat(verify),
+                                       repeat(validated))
+                results = [result for batch in batches for result in batch]
+        output_list = []
+        for bwt, message in results:
+            if message is not None:
+                print(message)
+            output_list.append(bwt)
         return tuple(output_list)
     except Exception as e:
         return e
@@ -380,7 +616,8 @@ def encode_file_as_word_list(input_file: str,
 
 def process_file(input_file: str,
                  end_char: str = '$',
-                 one_word: bool = False) -> bool | str:
+                 one_word: bool = False,
+                 verify: bool = False) -> bool | str:
     '''
     Takes a file path (str) and returns a new file with the same name but
     extension of .bwt. If not one_word, the BWT of each line is placed on
@@ -393,6 +630,8 @@ def process_file(input_file: str,
                         rather than the default of False
                         False, the file should be considered a list of words,
                         separated by '\n' or newline characters.
+    verify (bool)       True, authenticate each encoding by decoding it.
+                        False by default.
     Output:
     Write a file in the same folder as the input_file with the same name but
         with extension .bwt.
@@ -405,15 +644,17 @@ def process_file(input_file: str,
     else:
         try:
             output_tuple = encode_file_as_word_list(input_file,
-                                                    end_char=end_char)
+                                                    end_char=end_char,
+                                                    verify=verify)
             if not isinstance(output_tuple, tuple):    # error
                 return output_tuple
 
             # else write output file
             output_file = input_file[:-4] + '.bwt'
             with open(output_file, 'w') as f:
-                for bwt in output_tuple:
-                    f.write(bwt + '\n')
+                # join all the lines and write once, not once per line
+                if output_tuple:
+                    f.write('\n'.join(output_tuple) + '\n')
 
             return True
         except Exception as e:
@@ -439,7 +680,7 @@ def main(argv: tuple) -> str:
             print_help()
             return
         # else
-        status = process_file(input_file)
+        status = process_file(input_file, verify='--verify' in argv)
         if status is True:
             output_file = input_file[:-4] + '.bwt'
             print(f'Output file is saved as {output_file}.')
@@ -12,9 +12,13 @@ invert_bwt_via_map
     Takes a bwt string and returns the text it was encoded from.
     This function works by creating a last-first map for the bwt.
     Works in O[n log n] time.
+invert_bwt_cached
+    invert_bwt_via_map memoized with functools.lru_cache, used for files
+    where the same bwt may be on many lines.
 sort_string
     Takes a string astr, sorts its characters lexicographically and
-    returns the sorted string.
+    returns the sorted string. (not used by invert_bwt_via_map, which sorts
+    the indices of the bwt in build_map)
 build_map
     This function takes a string and returns a map of bwt to its true
     index (called the last-first map)
@@ -34,6 +38,14 @@ process_file
 decode_file_as_word_list
     Takes a path for a file input_file (str) and creates a tuple of decodings
     corresponding to the words in the file at the path.
+decode_line
+    Takes a line number and a line of a .bwt file, and returns its decoding
+    and the message to print for the line, if any.
+decode_lines
+    Runs decode_line over a slice of lines, the unit of work of a worker.
+slice_lines
+    Splits a list of lines into slices with about the same number of
+    characters.
 validate_bwt
     Validates bwt with two tests:
     Checks to see if the string has only one symbol.
@@ -43,8 +55,12 @@ validate_bwt
     string.
 '''
 
-from collections import deque
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 import os
+from string import ascii_lowercase, ascii_uppercase, digits
 from common import (
     all_chars_in_alphabet,
     authenticate,
@@ -55,18 +71,16 @@ from common import (
     )
 
 # GLOBAL VARIABLES
-ALPHABET = set()
-# add whitespace
-ALPHABET.add(chr(32))
-# add numbers 0 - 9
-for val in range(48, 48+10):
-    ALPHABET.add(chr(val))
-# add A-Z
-for val in range(65, 65+26):
-    ALPHABET.add(chr(val))
-# add a-z
-for val in range(97, 97+26):
-    ALPHABET.add(chr(val))
+# whitespace, numbers 0 - 9, A-Z and a-z
+ALPHABET = frozenset(' ' + digits + ascii_uppercase + ascii_lowercase)
+# translation table that deletes the characters of ALPHABET
+_DELETE_ALPHABET = str.maketrans('', '', ''.join(sorted(ALPHABET)))
+# characters validate_bwt scans before checking for a second symbol
+_BLOCK = 1 << 16
+# files with fewer characters are decoded in this process, decoding takes at
+# least about half a microsecond per character (more for long lines), starting
+# a pool of workers can take tens of milliseconds
+_POOL_MIN_CHARS = 1 << 18
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~ #
 # Functions for invert_bwt_via_map #
@@ -89,9 +103,10 @@ def sort_string(astr: str) -> str:
         >>> sort_string('annb$aa')
         '$aaabnn'
     '''
-    astr_sorted = [i for i in astr]
-    astr_sorted.sort()
-    astr_sorted = ''.join(astr_sorted)
+    # counting sort, count each character once (Counter counts in C) and
+    # repeat the distinct characters in order by their counts
+    counts = Counter(astr)
+    astr_sorted = ''.join([c * counts[c] for c in sorted(counts)])
     return astr_sorted
 
 
@@ -104,9 +119,6 @@ def build_map(last: str) -> tuple:
     Returns:
     tuple       true index stored at the curent index
 
-    Calls:
-    sort_string
-
     Examples
     >>> build_map('$')
     (0,)
@@ -119,24 +131,11 @@ def build_map(last: str) -> tuple:
     >>> build_map('3s$ avrraakd')
     (3, 2, 0, 4, 8, 9, 11, 10, 6, 7, 1, 5)
     '''
-    # sort last or bwt to get first
-    first = sort_string(last)
-    # make a map of char to queue of indices of char in last 
-    d = dict()
-    for i in range(len(last)):
-        char = last[i]
-        if char not in d:
-            d[char] = deque([i])
-        else:
-            d[char].append(i)
     # lf_map will map the index in first to the index in first that precedes it
-    # in the original text
-    lf_map = []
-    for c in first:
-        i = d[c].popleft()
-        lf_map.append(i)
-    # return a tuple
-    lf_map = tuple(lf_map)
+    # in the original text. first is last stably sorted, so the i-th
+    # character of first is the character at index lf_map[i] in last, and
+    # lf_map is the order of a stable sort of the indices of last by char.
+    lf_map = tuple(sorted(range(len(last)), key=last.__getitem__))
     return lf_map
 
 
@@ -169,16 +168,12 @@ def text_using_map(bwt: str, lf_map: tuple, end_char: str = '$') -> str:
 (3, 2, 0, 4, 8, 9, 11, 10, 6, 7, 1, 5))
     '3 aardvarks$'
     '''
-    text = ['' for _ in bwt]
     # find the place of the original string in the sorted rotations as
     #   the place of end_char in bwt the last column of rotations.
     x = bwt.index(end_char)
-    # create an empty list to be filled with correct order of characters
-    text = ['' for _ in bwt]
-    # fill text
-    for i in range(len(bwt)):
-        x = lf_map[x]
-        text[i] = bwt[x]
+    # fill text in one comprehension, each step follows the map from x and
+    # takes the character there, no list is preallocated and filled by index
+    text = [bwt[x := lf_map[x]] for _ in bwt]
     # return text as a string
     return ''.join(text)
 
@@ -197,9 +192,8 @@ def invert_bwt_via_map(bwt: str, end_char: str = '$') -> str:
     Returns:
     str       bwt decoded to the original text.
 
-    Calls:
-    build_map
-    text_from_map
+    build_map and text_using_map are done here in one pass, without
+    the tuple copy of the last-first map or a second function call.
 
     Examples:
     >>> invert_bwt_via_map('$')
@@ -214,12 +208,28 @@ def invert_bwt_via_map(bwt: str, end_char: str = '$') -> str:
     '3 aardvarks'
     >>> invert_bwt_via_map('annb$aa')
     'banana'
+    >>> invert_bwt_via_map('annb#aa', end_char='#')
+    'banana'
+    >>> invert_bwt_via_map('bnn€aaa', end_char='€')
+    'banana'
     '''
-    # build a last-first map
-    lf_map = build_map(bwt)
-    # get text from last-first map, includes end_char at the end
-    text = text_using_map(bwt, lf_map)
-    return text[:-1]
+    # work on bytes when possible, indexing bytes gives ints, which are
+    # cheaper to sort and gather than 1-character strings
+    ascii_only = bwt.isascii()
+    data = bwt.encode('ascii') if ascii_only else bwt
+    # build a last-first map, as in build_map
+    lf_map = sorted(range(len(data)), key=data.__getitem__)
+    # get text from last-first map as in text_using_map, the last step
+    # would only give end_char, so stop one step early instead of slicing
+    # end_char off a copy of text
+    x = bwt.index(end_char)
+    text = [data[x := lf_map[x]] for _ in range(len(data) - 1)]
+    text = bytes(text).decode('ascii') if ascii_only else ''.join(text)
+    return text
+
+
+# memoized invert_bwt_via_map, repeated lines of a file are inverted once
+invert_bwt_cached = lru_cache(maxsize=65536)(invert_bwt_via_map)
 
 
 # ~~~~ #
@@ -234,7 +244,7 @@ def print_help() -> None:
     print('')
     print('')
     print("Usage: python3 invert_bwt [-h|--help] \
-[-s bwt_string | -f filename]")
+[-s bwt_string | -f filename [--no-cache] [--verify]]")
     print("")
     print("Options:")
     print("-h | --help")
@@ -247,6 +257,12 @@ def print_help() -> None:
     print("    * Decoded text is always stored at the same path and file name")
     print("      but with an extension of .txt.")
     print("    * If the decoding works function returns True, else None.")
+    print("--no-cache")
+    print("    * Only with -f. Repeated lines are inverted once by default,")
+    print("      this inverts every line again and saves memory.")
+    print("--verify")
+    print("    * Only with -f. Checks each decoded line by encoding it back")
+    print("      to the bwt. Off by default as it doubles the work.")
     print("-s 'bwt_text'")
     print("    * Function looks for -f first then -s.")
     print("      If -f is found -s is ignored.")
@@ -297,65 +313,182 @@ def validate_bwt(string: str, line_no: int = None, end_char: str = '$') -> str:
     'abab$s'
     >>> validate_bwt('abab$s', 10)
     'abab$s'
+    >>> validate_bwt('abab#s')
+    'abab$s'
+    >>> validate_bwt('a' * (_BLOCK - 1) + '$#' + 'a')
+    'String has more than one symbols.'
+    >>> validate_bwt('$' + 'a' * _BLOCK + '#')
+    'String has more than one symbols.'
+    >>> validate_bwt('a' * _BLOCK + 'b' * _BLOCK)
+    'String has no symbols.'
+    >>> bwt = validate_bwt('a' * (_BLOCK + 5) + '#' + 'a')
+    >>> bwt.index('$'), len(bwt)
+    (65541, 65543)
     '''
-    # counting non-space alphanumeric characters and saving their indices
-    indices_non = []
-    n = len(string)
-    for i in range(n):
-        if string[i] in ALPHABET:
-            continue
-        indices_non.append(i)
-    if len(indices_non) == 0:
+    # delete all the characters of ALPHABET (str.translate runs in C), what
+    # is left are the symbols. A long string goes a block at a time so that
+    # one with more than one symbol is rejected without scanning all of it.
+    if len(string) <= _BLOCK:
+        symbols = string.translate(_DELETE_ALPHABET)
+    else:
+        symbols = ''
+        for start in range(0, len(string), _BLOCK):
+            block = string[start:start + _BLOCK]
+            symbols += block.translate(_DELETE_ALPHABET)
+            if len(symbols) > 1:
+                break
+    if len(symbols) == 0:
         if line_no:     # being used in a file
             return f'Line no. {line_no} has no symbols.'
         else:           # being used as a string
             return 'String has no symbols.'
         return
-    if len(indices_non) > 1:
+    if len(symbols) > 1:
         if line_no:     # being used in a file
             return f'Line no. {line_no} has more than one symbols.'
         else:           # being used as a string
             return 'String has more than one symbols.'
-    # if only one symbol, replace it with end_char
-    i = indices_non[0]
+    # if only one symbol and it is end_char already, there is nothing to copy
+    if symbols == end_char:
+        return string
+    # else replace it with end_char
+    i = string.index(symbols)
     bwt = string[:i] + end_char + string[i+1:]
     return bwt
 
 
+def decode_line(line_no: int,
+                raw_bwt: str,
+                end_char: str = '$',
+                cache: bool = True,
+                verify: bool = False) -> tuple:
+    '''
+    Takes a line number (int), a line of a .bwt file (str), a user
+    provided EOF `end_char` and booleans `cache` and `verify`. Validates
+    and decodes the line, and if `verify` authenticates the decoding. If
+    `cache`, a line seen before by this process is not inverted again.
+    Returns a tuple of the text ('' if the line is not processed) and the
+    message to print for the line (None if there is nothing to print).
+    Kept at module level so that it can be sent to worker processes.
+
+    Examples:
+    >>> decode_line(1, 'ipssm$pissii\\n', cache=False)
+    ('mississippi', None)
+    >>> decode_line(1, 'ipssm$pissii\\n', cache=True)
+    ('mississippi', None)
+    >>> decode_line(1, 'ipssm$pissii\\n', cache=True)
+    ('mississippi', None)
+    >>> decode_line(2, 'abc\\n', cache=False)
+    ('', 'Line no. 2 has no symbols.')
+    >>> decode_line(2, 'abc\\n', cache=True)
+    ('', 'Line no. 2 has no symbols.')
+    >>> decode_line(3, 'a$b$\\n', cache=False)
+    ('', 'Line no. 3 has more than one symbols.')
+    >>> decode_line(3, 'a$b$\\n', cache=True)
+    ('', 'Line no. 3 has more than one symbols.')
+    '''
+    # leading and trailing spaces may be a part of the transform
+    # strip only the newline character
+    raw_bwt = raw_bwt.strip('\n')
+    try:    # try and except for each line
+        bwt = validate_bwt(raw_bwt, line_no)
+        if bwt != raw_bwt:   # error
+            return '', bwt
+        invert = invert_bwt_cached if cache else invert_bwt_via_map
+        text = invert(bwt, end_char)
+        if not verify or authenticate(bwt, text, end_char=end_char):
+            return text, None
+        return '', f"Error while processing line no. {line_no}:\
+unable to encode to BWT."
+    except Exception as e:
+        return '', f"Error in line no. {line_no}: {e}"
+
+
+def decode_lines(first_line_no: int,
+                 lines: list,
+                 end_char: str = '$',
+                 cache: bool = True,
+                 verify: bool = False) -> list:
+    '''
+    Takes the line number of the first line (int), a list of lines of a
+    .bwt file and the arguments of decode_line. Returns a list of the
+    decode_line results, in order. A worker process is sent a slice of
+    lines to loop over, rather than one line at a time.
+    '''
+    return [decode_line(line_no, raw_bwt, end_char, cache, verify)
+            for line_no, raw_bwt in enumerate(lines, first_line_no)]
+
+
+def slice_lines(lines: list, parts: int) -> tuple:
+    '''
+    Takes a list of lines of a .bwt file and the number of slices wanted
+    (int). Returns a tuple of the indices of the first lines of the slices
+    and a tuple of the slices, at most `parts` consecutive slices with about
+    the same number of characters, since the work of a line grows with its
+    length.
+
+    >>> slice_lines(['a$' * 5, 'b', 'c', 'd$' * 5], 2)
+    ((0, 2), (['a$a$a$a$a$', 'b'], ['c', 'd$d$d$d$d$']))
+    >>> slice_lines(['abc', 'de'], 4)
+    ((0, 1), (['abc'], ['de']))
+    '''
+    total = sum(map(len, lines))
+    starts, slices = [], []
+    start = done = 0
+    for i, line in enumerate(lines):
+        done += len(line)
+        if done * parts >= total * (len(slices) + 1):
+            starts.append(start)
+            slices.append(lines[start:i + 1])
+            start = i + 1
+    if start < len(lines):
+        starts.append(start)
+        slices.append(lines[start:])
+    return tuple(starts), tuple(slices)
+
+
 def decode_file_as_word_list(input_file: str,
-                             end_char: str = '$') -> tuple:
+                             end_char: str = '$',
+                             cache: bool = True,
+                             verify: bool = False) -> tuple:
     '''
     Takes a path for a file input_file (str) and a user provided EOF `end_str`.
     If any of the words in the file is not processed, prints to the terminal.
     Returns a tuple of strings corresponding to the words in the file
     at the path or a message (str) if the file is not processed.
+    The lines are independent, so a large file, on a machine with more than
+    one CPU, is decoded in parallel by a pool of worker processes, each
+    given slices of lines with about the same number of characters. The
+    results are collected in order.
+    If `cache`, repeated lines are inverted once per process.
+    If `verify`, each decoding is authenticated by encoding it again, which
+    doubles the work per line.
     '''
     try:       # try and except for some error in reading the file
-        output_list = []
         with open(input_file, 'r') as f_in:
-            counter = 0
-            for raw_bwt in f_in:
-                # leading and trailing spaces may be a part of the transform
-                # strip only the newline character
-                raw_bwt = raw_bwt.strip('\n')
-                try:    # try and except for each line
-                    bwt = validate_bwt(raw_bwt, counter)
-                    if bwt == raw_bwt:
-                        temp_text = invert_bwt_via_map(bwt, end_char=end_char)
-                        if authenticate(bwt, temp_text, end_char=end_char):
-                            text = temp_text
-                        else:
-                            print(f"Error while processing line no. {counter}:\
-unable to encode to BWT.")
-                            text = ''
-                    else:   # error
-                        print(bwt)
-                        text = ''
-                except Exception as e:
-                    print(f"Error in line no. {counter}: {e}")
-                    text = ''
-                output_list.append(text)
-                counter += 1
+            data = f_in.read()     # the file is expected to be 1 MB or less
+        lines = data.split('\n')
+        if lines[-1] == '':     # the file ends with a newline
+            lines.pop()
+        workers = os.cpu_count() or 1
+        if workers == 1 or len(lines) < 2 or len(data) < _POOL_MIN_CHARS:
+            results = decode_lines(0, lines, end_char, cache, verify)
+        else:
+            # a few slices per worker, so that the work stays balanced
+            starts, slices = slice_lines(lines, workers * 4)
+            with ProcessPoolExecutor(workers) as executor:
+                batches = executor.map(decode_lines,
+                                       starts,
+                                       slices,
+                                       repeat(end_char),
+                                       repeat(cache),
+                                       repeat(verify))
+                results = [result for batch in batches for result in batch]
+        output_list = []
+        for text, message in results:
+            if message is not None:
+                print(message)
+            output_list.append(text)
         return tuple(output_list)
     except Exception as e:
         return e
@@ -363,7 +496,9 @@ unable to encode to BWT.")
 
 def process_file(input_file: str,
                  end_char: str = '$',
-                 one_word: bool = False) -> bool | str:
+                 one_word: bool = False,
+                 cache: bool = True,
+                 verify: bool = False) -> bool | str:
     '''
     Takes a file path `input_file`(str), a user provided EOF `end_char`, and
     a boolean `one_word`. Creates a new file with the same name but extension
@@ -379,6 +514,10 @@ def process_file(input_file: str,
                         rather than the default of False.
                         False, the file should be considered a list of words,
                         separated by '\n' or newline characters.
+    cache (bool)        True by default, repeated lines are inverted once.
+                        False, every line is inverted, uses less memory.
+    verify (bool)       True, authenticate each decoding by encoding it.
+                        False by default.
 
     Output:
     Write a file in the same folder as the input_file with the same name but
@@ -394,13 +533,16 @@ def process_file(input_file: str,
         try:
             output_tuple = decode_file_as_word_list(
                 input_file,
-                end_char=end_char)
+                end_char=end_char,
+                cache=cache,
+                verify=verify)
             if not isinstance(output_tuple, tuple):     # error
                 return output_tuple
             output_file = input_file[:-4] + '.txt'
             with open(output_file, 'w') as f:
-                for text in output_tuple:
-                    f.write(text + '\n')
+                # join all the lines and write once, not once per line
+                if output_tuple:
+                    f.write('\n'.join(output_tuple) + '\n')
             return True
         except Exception as e:
             return e
@@ -426,7 +568,9 @@ def main(argv: tuple) -> str:
             print(input_file)
             print_help()
             return
-        status = process_file(input_file)
+        status = process_file(input_file,
+                              cache='--no-cache' not in argv,
+                              verify='--verify' in argv)
         if status is True:
             output_file = input_file[:-4] + '.txt'
             print(f'Output file is saved as {output_file}.')